@@ -0,0 +1,60 @@
+"""
+Compares pd.json_normalize + column slices (the previous transform) with the single-pass extract_tables
+on the saved pages from json_files. Run from the project root: python benchmarks/normalize.py
+"""
+import sys
+import tracemalloc
+from contextlib import redirect_stdout
+from io import StringIO
+from json import loads
+from time import perf_counter
+
+import pandas as pd
+from numpy import nan
+
+sys.path.insert(0, '.')
+from launches_etl.schema import TABLE_FIELDS
+from launches_etl.store import get_json_files
+from launches_etl.transform import extract_tables, create_df, transform_df
+
+
+def json_normalize_tables(results):
+    """The previous path: flattens every field, then slices, cleans and renames columns of each table"""
+    original_df = pd.json_normalize(results)
+    dataframes = {}
+    for table, fields in TABLE_FIELDS.items():
+        df = original_df[list(fields.values())]
+        df = df.replace({nan: None})
+        df = df.replace({'': None})
+        dataframes[table] = df.rename(columns={path: column for column, path in fields.items()})
+    return dataframes
+
+
+def extract_tables_dataframes(results):
+    """The current path: walks the JSON once and builds dataframes straight from column lists"""
+    tables = extract_tables(results)
+    return {table: transform_df(f'{table}_df', create_df(f'{table}_df', tables)) for table in TABLE_FIELDS}
+
+
+def measure(function, pages):
+    """Returns seconds and peak traced memory (MB) needed to process all pages"""
+    tracemalloc.start()
+    start = perf_counter()
+    with redirect_stdout(StringIO()):
+        for results in pages:
+            function(results)
+    seconds = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return seconds, peak
+
+
+if __name__ == '__main__':
+    pages = []
+    for file_path in get_json_files('./json_files'):
+        with open(file_path) as f:
+            pages.append(loads(f.read())['results'])
+    print(f"{len(pages)} pages, {sum(len(results) for results in pages)} launches")
+    for function in [json_normalize_tables, extract_tables_dataframes]:
+        seconds, peak = measure(function, pages)
+        print(f"{function.__name__:<28} {seconds:8.3f} s {peak:8.2f} MB peak")
@@ -0,0 +1,303 @@
+"""
+Benchmark suite on the saved pages from json_files and their synthetic scale-ups (launches copied with new ids).
+Every stage runs in a fresh process, so its peak RSS isn't mixed with other stages.
+DB stages need a postgres server where a throwaway database can be created (--dsn or BENCHMARK_DSN).
+Run from the project root:
+
+    python benchmarks/suite.py --scale 1 10 100 --dsn postgresql://postgres@localhost/postgres
+    python benchmarks/suite.py --save-baseline  # Stores results in benchmarks/baseline.json
+
+Results are compared with the stored baseline, the exit code is 1 when a stage regressed or there's no baseline
+(baselines depend on the machine, so none is committed: save one before changing the code).
+"""
+import sys
+from argparse import ArgumentParser
+from contextlib import contextmanager, redirect_stdout
+from io import StringIO
+from json import dumps, loads
+from multiprocessing import get_context
+from os import environ, getpid
+from os.path import exists
+from resource import getrusage, RUSAGE_SELF
+from statistics import median, quantiles
+from time import perf_counter
+from uuid import uuid5, NAMESPACE_URL
+
+sys.path.insert(0, '.')
+
+BASELINE_PATH = './benchmarks/baseline.json'
+TOLERANCE = 0.2  # A stage regressed when it's 20% slower or uses 20% more memory than the baseline
+VIEW_QUERIES = {
+    'leading_country_per_year_vw': "SELECT * FROM leading_country_per_year_vw",
+    'rocket_family_stats_vw': "SELECT * FROM rocket_family_stats_vw",
+    'launches_per_year': """
+        SELECT EXTRACT(YEAR FROM launch_time) AS year, count(*) total_launches
+        FROM launch WHERE status_id = 3 GROUP BY 1 ORDER BY 2 DESC
+    """,
+    'popular_spaceports': """
+        SELECT lo.location_id, lo.location_name, count(*) total_launches
+        FROM location lo INNER JOIN launch la ON lo.location_id = la.location_id
+        GROUP BY 1, 2 ORDER BY 3 DESC
+    """
+}
+QUERY_REPEATS = 20
+
+
+def load_pages(folder_path='./json_files'):
+    """Returns pages (lists of launches) of the saved JSON files"""
+    from launches_etl.store import get_json_files
+    pages = []
+    for file_path in get_json_files(folder_path):
+        with open(file_path) as f:
+            pages.append(loads(f.read())['results'])
+    return pages
+
+
+def scale_pages(pages, factor):
+    """
+        Repeats the corpus 'factor' times. Copies get new launch ids, slugs, rocket and mission ids,
+        pads, locations and statuses are shared as they are in the real data
+    """
+    scaled = list(pages)
+    for copy in range(1, factor):
+        for page in pages:
+            page = loads(dumps(page))
+            for launch in page:
+                launch['id'] = str(uuid5(NAMESPACE_URL, f"{launch['id']}/{copy}"))
+                launch['slug'] = f"{launch['slug']}-{copy}"
+                launch['rocket']['id'] += copy * 10 ** 6
+                if launch['mission']:
+                    launch['mission']['id'] += copy * 10 ** 6
+            scaled.append(page)
+    return scaled
+
+
+@contextmanager
+def scratch_database(dsn):
+    """Creates a throwaway database and drops it when the stage is finished"""
+    from psycopg2 import connect
+    admin = connect(dsn)
+    admin.autocommit = True
+    name = f'launches_benchmark_{getpid()}'
+    admin.cursor().execute(f"CREATE DATABASE {name}")
+    conn = connect(dsn, dbname=name)
+    try:
+        yield conn
+    finally:
+        conn.close()
+        admin.cursor().execute(f"DROP DATABASE IF EXISTS {name}")
+        admin.close()
+
+
+def create_tables(cur):
+    from launches_etl.schema import TABLE_COLUMNS, create_table
+    for table in TABLE_COLUMNS:
+        create_table(table, cur)
+
+
+def transformed_pages(pages):
+    """Returns transformed dataframes of every page, prepared outside of timed code"""
+    from launches_etl.schema import TABLE_COLUMNS
+    from launches_etl.transform import extract_tables, create_df, transform_df
+    result = []
+    for page in pages:
+        tables = extract_tables(page)
+        result.append({table: transform_df(f'{table}_df', create_df(f'{table}_df', tables)) for table in TABLE_COLUMNS})
+    return result
+
+
+def stage_json_normalize(pages, dsn):
+    import pandas as pd
+    samples = []
+    for page in pages:
+        start = perf_counter()
+        pd.json_normalize(page)
+        samples.append(perf_counter() - start)
+    return samples
+
+
+def stage_extract(pages, dsn):
+    from launches_etl.transform import extract_tables
+    samples = []
+    for page in pages:
+        start = perf_counter()
+        extract_tables(page)
+        samples.append(perf_counter() - start)
+    return samples
+
+
+def stage_transform(pages, dsn):
+    from launches_etl.schema import TABLE_COLUMNS
+    from launches_etl.transform import extract_tables, create_df, transform_df
+    extracted = [extract_tables(page) for page in pages]
+    samples = []
+    for tables in extracted:
+        start = perf_counter()
+        for table in TABLE_COLUMNS:
+            transform_df(f'{table}_df', create_df(f'{table}_df', tables))
+        samples.append(perf_counter() - start)
+    return samples
+
+
+def insert_samples(pages, dsn, method):
+    from launches_etl.load import inserting_data
+    dataframes = transformed_pages(pages)
+    samples = []
+    with scratch_database(dsn) as conn:
+        cur = conn.cursor()
+        create_tables(cur)
+        conn.commit()
+        for page in dataframes:
+            start = perf_counter()
+            for table, df in page.items():
+                inserting_data(table, df, conn, cur, method=method)
+            conn.commit()
+            samples.append(perf_counter() - start)
+    return samples
+
+
+def stage_insert_copy(pages, dsn):
+    return insert_samples(pages, dsn, 'copy')
+
+
+def stage_insert_batch(pages, dsn):
+    return insert_samples(pages, dsn, 'batch')
+
+
+def stage_end_to_end(pages, dsn):
+    """The same steps as replay: extraction, transformation, loading, indexes and views"""
+    from launches_etl.load import HashCache
+    from launches_etl.pipeline import process_page
+    from launches_etl.schema import recreate_tables, build_indexes, create_views
+    from launches_etl.transform import extract_tables
+    samples = []
+    hash_cache = HashCache()
+    with scratch_database(dsn) as conn:
+        cur = conn.cursor()
+        for it_done, page in enumerate(pages):
+            start = perf_counter()
+            if it_done == 0:
+                recreate_tables(cur)
+            process_page(conn, cur, extract_tables(page), hash_cache=hash_cache)
+            if it_done == len(pages) - 1:
+                build_indexes(cur)
+                create_views(cur)
+            conn.commit()
+            hash_cache.page_done()
+            samples.append(perf_counter() - start)
+    return samples
+
+
+def stage_view_queries(pages, dsn):
+    """Samples are runs of the view and README queries, not pages"""
+    from launches_etl.load import HashCache
+    from launches_etl.pipeline import process_page
+    from launches_etl.schema import recreate_tables, build_indexes, create_views
+    from launches_etl.transform import extract_tables
+    samples = []
+    hash_cache = HashCache()
+    with scratch_database(dsn) as conn:
+        cur = conn.cursor()
+        recreate_tables(cur)
+        for page in pages:
+            process_page(conn, cur, extract_tables(page), hash_cache=hash_cache)
+            hash_cache.page_done()
+        build_indexes(cur)
+        create_views(cur)
+        conn.commit()
+        for _ in range(QUERY_REPEATS):
+            for query in VIEW_QUERIES.values():
+                start = perf_counter()
+                cur.execute(query)
+                cur.fetchall()
+                samples.append(perf_counter() - start)
+    return samples
+
+
+STAGES = {
+    'json_normalize': (stage_json_normalize, False),  # stage -> (function, needs a DB)
+    'extract': (stage_extract, False),
+    'create_transform_df': (stage_transform, False),
+    'insert_copy': (stage_insert_copy, True),
+    'insert_batch': (stage_insert_batch, True),
+    'end_to_end': (stage_end_to_end, True),
+    'view_queries': (stage_view_queries, True)
+}
+
+
+def run_stage(stage, factor, dsn):
+    """Runs in a separate process: returns per-page seconds, number of launches and peak RSS"""
+    pages = scale_pages(load_pages(), factor)
+    function, _ = STAGES[stage]
+    with redirect_stdout(StringIO()):  # Progress messages of the pipeline
+        samples = function(pages, dsn)
+    return samples, sum(len(page) for page in pages), getrusage(RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(samples, launches):
+    p95 = quantiles(samples, n=20)[-1] if len(samples) > 1 else samples[0]
+    return {
+        'launches': launches,
+        'seconds': round(sum(samples), 4),
+        'rows_per_s': round(launches / sum(samples), 1),
+        'p50_ms': round(median(samples) * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3)
+    }
+
+
+def compare(results, baseline):
+    """Returns descriptions of stages which are slower or use more memory than the baseline"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        previous = baseline[name]
+        if result['rows_per_s'] < previous['rows_per_s'] * (1 - TOLERANCE):
+            regressions.append(f"{name}: {result['rows_per_s']} rows/s, baseline {previous['rows_per_s']}")
+        if result['peak_rss_mb'] > previous['peak_rss_mb'] * (1 + TOLERANCE):
+            regressions.append(f"{name}: {result['peak_rss_mb']} MB peak RSS, baseline {previous['peak_rss_mb']}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10], help='corpus multipliers, e.g. 1 10 100')
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--dsn', default=environ.get('BENCHMARK_DSN'), help='postgres server for DB stages')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    results = {}
+    context = get_context('spawn')
+    print(f"{'stage':<30} {'launches':>9} {'rows/s':>12} {'p50 ms':>9} {'p95 ms':>9} {'peak RSS MB':>12}")
+    for factor in args.scale:
+        for stage in args.stages:
+            if STAGES[stage][1] and not args.dsn:
+                continue
+            with context.Pool(1) as pool:
+                samples, launches, peak_rss = pool.apply(run_stage, (stage, factor, args.dsn))
+            name = f'{stage}@{factor}x'
+            results[name] = dict(summarize(samples, launches), peak_rss_mb=round(peak_rss, 1))
+            result = results[name]
+            print(f"{name:<30} {launches:>9} {result['rows_per_s']:>12} {result['p50_ms']:>9} "
+                  f"{result['p95_ms']:>9} {result['peak_rss_mb']:>12}")
+    if not args.dsn:
+        print("DB stages were skipped, set --dsn or BENCHMARK_DSN")
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            f.write(dumps(results, indent=2))
+        print(f"Baseline saved to {BASELINE_PATH}")
+        return 0
+    if not exists(BASELINE_PATH):
+        print(f"No baseline to compare with at {BASELINE_PATH}, save one with --save-baseline")
+        return 1
+    with open(BASELINE_PATH) as f:
+        regressions = compare(results, loads(f.read()))
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,31 @@
+"""
+ETL of rocket launches from The Space Devs API to PostgreSQL.
+Functions are imported from their modules on first use, so importing the package doesn't load pandas or requests
+"""
+from importlib import import_module
+
+_MODULES = {  # Public name -> module defining it
+    'fetch': 'pipeline',
+    'sync': 'pipeline',
+    'replay': 'pipeline',
+    'process_page': 'pipeline',
+    'build_indexes': 'schema',
+    'refresh_views': 'schema',
+    'create_table': 'schema',
+    'extract_tables': 'transform',
+    'create_df': 'transform',
+    'transform_df': 'transform',
+    'validate_df': 'transform',
+    'load_tables': 'load',
+    'read_launch': 'store'
+}
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(import_module(f'.{_MODULES[name]}', __name__), name)
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_MODULES))
@@ -0,0 +1,157 @@
+"""Requests to The Space Devs API"""
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+from time import sleep, monotonic, time
+from os import makedirs, replace
+from os.path import exists
+from threading import Lock, local
+from queue import Empty
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from json import dumps, loads
+from gzip import compress, decompress
+from hashlib import sha1
+from random import uniform
+from re import search
+
+from .metrics import metrics
+from .settings import (PAGE_SIZE, API_REQUESTS_PER_HOUR, API_BURST, HTTP_CACHE_PATH, HTTP_TIMEOUT, HTTP_RETRIES,
+                       HTTP_BACKOFF)
+
+
+class TokenBucket:
+    """Spaces API requests: holds up to 'capacity' tokens which are refilled at 'rate' tokens per hour"""
+
+    def __init__(self, rate=API_REQUESTS_PER_HOUR, capacity=API_BURST):
+        self.interval = 3600 / rate  # Seconds needed to refill one token
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        """Takes a token, waits for it if the bucket is empty"""
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+            self.updated = now
+            if self.tokens < 1:
+                sleep((1 - self.tokens) * self.interval)
+                self.tokens, self.updated = 1, monotonic()
+            self.tokens -= 1
+
+
+class ApiClient:
+    """
+        Sends API requests through a keep-alive session (one per thread) with compressed transfer:
+        1. Responses are cached by URL, a cached page is returned without a request while it's fresh (max-age),
+           later it's revalidated with If-None-Match / If-Modified-Since and 304 returns the cached page;
+        2. Every request takes a token from the bucket, 429 / 5xx responses and connection errors are retried
+           with a jittered exponential backoff
+    """
+
+    def __init__(self, bucket, cache_path=HTTP_CACHE_PATH):
+        self.bucket = bucket
+        self.cache_path = cache_path
+        self.sessions = local()
+        makedirs(cache_path, exist_ok=True)
+
+    @property
+    def session(self):
+        if not hasattr(self.sessions, 'session'):
+            session = Session()
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Accept': 'application/json'})
+            self.sessions.session = session
+        return self.sessions.session
+
+    def cache_file(self, url):
+        return f"{self.cache_path}/{sha1(url.encode()).hexdigest()}.json.gz"
+
+    def read_cache(self, url):
+        if not exists(self.cache_file(url)):
+            return None
+        with open(self.cache_file(url), 'rb') as f:
+            return loads(decompress(f.read()))
+
+    def write_cache(self, url, r, data, previous=None):
+        """Saves a response, validators a 304 doesn't repeat are kept from the 'previous' cache entry"""
+        max_age = search(r'max-age=(\d+)', r.headers.get('Cache-Control', ''))
+        entry = {
+            'url': url,
+            'etag': r.headers.get('ETag') or (previous or {}).get('etag'),
+            'last_modified': r.headers.get('Last-Modified') or (previous or {}).get('last_modified'),
+            'expires': time() + int(max_age.group(1)) if max_age else 0,
+            'data': data
+        }
+        with open(self.cache_file(url) + '.tmp', 'wb') as f:
+            f.write(compress(dumps(entry).encode()))
+        replace(self.cache_file(url) + '.tmp', self.cache_file(url))
+
+    def get_json(self, url):
+        """Returns JSON of a page from the cache or the API"""
+        entry = self.read_cache(url)
+        if entry is not None and entry['expires'] > time():
+            metrics.count('api_cache_hits')
+            return entry['data']
+        headers = {}
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        for attempt in range(HTTP_RETRIES + 1):
+            self.bucket.acquire()
+            metrics.count('api_requests')
+            r, error = None, None
+            try:
+                with metrics.timer('fetch'):
+                    r = self.session.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+            except (RequestsConnectionError, Timeout) as e:
+                error = e
+            if r is not None and r.status_code == 304:
+                metrics.count('api_not_modified')
+                self.write_cache(url, r, entry['data'], entry)
+                return entry['data']
+            if r is not None and r.status_code != 429 and r.status_code < 500:
+                r.raise_for_status()
+                data = r.json()
+                metrics.count('bytes_fetched', value=len(r.content))
+                self.write_cache(url, r, data)
+                return data
+            if attempt == HTTP_RETRIES:
+                if error is not None:
+                    raise error
+                r.raise_for_status()
+
+            retry_after = r.headers.get('Retry-After', '') if r is not None else ''
+            delay = int(retry_after) if retry_after.isdigit() else HTTP_BACKOFF * 2 ** attempt
+            print(f"Request failed ({error or r.status_code}), retrying in {delay} seconds")
+            metrics.count('api_retries')
+            sleep(delay * uniform(1, 1.5))  # Jitter, so parallel workers don't retry at the same moment
+
+
+def get_page_url(offset, **params):
+    """Returns API_ENDPOINT with limit, offset and other given query parameters"""
+    from config import API_ENDPOINT
+    url = urlsplit(API_ENDPOINT)
+    query = dict(parse_qsl(url.query))
+    query.update(limit=PAGE_SIZE, offset=offset, **params)
+    return urlunsplit(url._replace(query=urlencode(query)))
+
+
+def fetch_pages(offset_queue, page_queue, client):
+    """Fetches pages for offsets from offset_queue and puts (offset, data) to page_queue, None when finished"""
+    while True:
+        try:
+            offset = offset_queue.get_nowait()
+        except Empty:
+            break
+        api_endpoint = get_page_url(offset)
+        print(api_endpoint)
+        try:
+            page_queue.put((offset, client.get_json(api_endpoint)))
+        except Exception as e:  # The page is not added to the checkpoint, so it's fetched again on the next run
+            print(e)
+            page_queue.put((offset, None))
+    page_queue.put(None)
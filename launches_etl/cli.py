@@ -0,0 +1,122 @@
+"""
+Command line interface: python -m launches_etl <command>. Modules of a command are imported when it runs,
+so refresh-views and stats don't load pandas, numpy or requests
+"""
+from argparse import ArgumentParser, ArgumentTypeError
+from time import localtime, strftime
+
+from .settings import COMMIT_EVERY, TRANSFORM_WORKERS
+
+TOP_STAGES = 10  # Slowest stages printed by stats
+
+
+def positive_int(value):
+    """Argument type of counts that must be at least 1"""
+    number = int(value) if value.isdigit() else 0
+    if number < 1:
+        raise ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def run_fetch(args):
+    from .pipeline import fetch, sync
+    if args.since_last_run:
+        return 0 if sync(args.commit_every) else 1
+    return 0 if fetch(args.commit_every, args.workers) else 1
+
+
+def run_replay(args):
+    from .pipeline import replay
+    return 0 if replay(args.path, args.commit_every, args.transform_workers) else 1
+
+
+def run_load(args):
+    from .pipeline import replay
+    return 0 if replay(args.path, args.commit_every, args.transform_workers, refresh=True) else 1
+
+
+def run_build_indexes(args):
+    from .db import DBConnection, get_db_pool
+    from .metrics import metrics
+    from .schema import build_indexes
+    db = DBConnection(get_db_pool())
+    completed = False
+    try:
+        built = build_indexes(db.cur)
+        completed = True  # What succeeded is kept, the exit code reports the failure
+    finally:
+        db.close(commit=completed)
+    metrics.write('build_indexes')
+    return 0 if built else 1
+
+
+def run_refresh_views(args):
+    from .db import DBConnection, get_db_pool
+    from .metrics import metrics
+    from .schema import refresh_views
+    db = DBConnection(get_db_pool())
+    completed = False
+    try:
+        refreshed = refresh_views(db.cur)
+        completed = True  # What succeeded is kept, the exit code reports the failure
+    finally:
+        db.close(commit=completed)
+    metrics.write('refresh_views')
+    return 0 if refreshed else 1
+
+
+def run_stats(args):
+    from .metrics import get_reports
+    reports = get_reports(args.run, args.last)
+    if not reports:
+        print("No saved runs")
+        return 1
+    for file_name, report in reports:
+        print(f"{file_name}: started {report['started']}, {report['seconds']} s")
+        for counter in report['counters']:
+            table = f" {counter['table']}" if counter['table'] else ''
+            print(f"    {counter['name']}{table}: {counter['value']}")
+        for stage in sorted(report['stages'], key=lambda stage: stage['seconds'], reverse=True)[:TOP_STAGES]:
+            table = f" {stage['table']}" if stage['table'] else ''
+            print(f"    {stage['stage']}{table}: {stage['calls']} calls, {stage['seconds']:.3f} s")
+    return 0
+
+
+def get_parser():
+    parser = ArgumentParser(prog='launches_etl', description="ETL of rocket launches from The Space Devs API")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fetch = commands.add_parser('fetch', help="loads launches from the API")
+    fetch.add_argument('--workers', type=positive_int, default=1, help="threads fetching pages")
+    fetch.add_argument('--since-last-run', action='store_true',
+                       help="upserts only launches updated since the last run, tables are kept")
+    fetch.set_defaults(handler=run_fetch, completed=True)
+
+    replay = commands.add_parser('replay', help="rebuilds the database from a raw store segment or a folder of pages")
+    load = commands.add_parser('load', help="upserts new and changed rows of a segment or a folder into the tables")
+    replay.set_defaults(handler=run_replay, completed=True)
+    load.set_defaults(handler=run_load, completed=True)
+    for command in [replay, load]:
+        command.add_argument('path', nargs='?', default='./json_files')
+        command.add_argument('--transform-workers', type=int, default=TRANSFORM_WORKERS)
+    for command in [fetch, replay, load]:
+        command.add_argument('--commit-every', type=int, default=COMMIT_EVERY, help="pages per transaction")
+
+    commands.add_parser('build-indexes', help="creates foreign keys and indexes, runs ANALYZE").set_defaults(
+        handler=run_build_indexes)
+    commands.add_parser('refresh-views', help="refreshes materialized views").set_defaults(handler=run_refresh_views)
+
+    stats = commands.add_parser('stats', help="prints counters and the slowest stages of saved runs")
+    stats.add_argument('--run', help="only runs of this command, e.g. replay")
+    stats.add_argument('--last', type=int, default=1, help="number of runs")
+    stats.set_defaults(handler=run_stats)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    exit_code = args.handler(args) or 0
+    if getattr(args, 'completed', False):
+        state = 'HAS BEEN COMPLETED' if exit_code == 0 else 'HAS FAILED'
+        print(f"DATABASE POPULATION {state}\nTIME: {strftime('%H:%M:%S', localtime())}")
+    return exit_code
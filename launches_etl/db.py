@@ -0,0 +1,73 @@
+"""Connections to the postgres database"""
+from psycopg2.pool import ThreadedConnectionPool
+
+from .metrics import metrics
+from .settings import COMMIT_EVERY
+
+
+def get_db_pool(maxconn=1):
+    """Creates a pool of connections to the postgres database"""
+    from config import SQL_PARAMS  # Read when a command connects, so importing the package needs no config
+    pool = ThreadedConnectionPool(
+        1, maxconn,
+        user=SQL_PARAMS['user'],
+        password=SQL_PARAMS['password'],
+        host=SQL_PARAMS['host'],
+        port=SQL_PARAMS['port'],
+        dbname=SQL_PARAMS['database']
+    )
+    return pool
+
+
+class DBConnection:
+    """
+        Holds one connection from the pool for the whole run:
+        1. Every page is loaded inside a savepoint, so a failed page doesn't discard the previous ones
+           (with commit_every=0 a failed page fails the run);
+        2. The transaction is committed every 'commit_every' pages (0 - once, when the run is completed).
+           Pages after the last commit are rolled back when the run raises
+    """
+
+    def __init__(self, pool, commit_every=COMMIT_EVERY):
+        self.pool = pool
+        self.conn = pool.getconn()
+        self.cur = self.conn.cursor()
+        self.commit_every = commit_every
+        self.pages_done = 0
+
+    def start_page(self):
+        self.cur.execute("SAVEPOINT page_load")
+
+    def page_failed(self, error):
+        """Discards the page. A run loaded in one transaction (commit_every=0) is atomic, so it fails as a whole"""
+        metrics.count('pages_failed')
+        if not self.commit_every:
+            raise error
+        self.cur.execute("ROLLBACK TO SAVEPOINT page_load")
+
+    def page_done(self):
+        """Returns True when the transaction was committed"""
+        self.cur.execute("RELEASE SAVEPOINT page_load")  # Open subtransactions slow down snapshots of every backend
+        self.pages_done += 1
+        metrics.count('pages')
+        if self.commit_every and self.pages_done % self.commit_every == 0:
+            with metrics.timer('commit'):
+                self.conn.commit()
+            print(f"Transaction committed after {self.pages_done} pages")
+            return True
+        return False
+
+    def close(self, commit=True):
+        """
+            Commits the rest of the pages (rolls them back with commit=False, when the run raised)
+            and returns the connection to the pool
+        """
+        if commit:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+            print("Transaction rolled back.")
+        self.cur.close()
+        self.pool.putconn(self.conn)
+        self.pool.closeall()
+        print("Connection closed.")
@@ -0,0 +1,50 @@
+"""Export of the loaded tables as Parquet"""
+import pandas as pd
+from os import makedirs
+from shutil import rmtree
+
+from .metrics import metrics
+from .schema import TABLE_COLUMNS, TABLE_KEYS
+
+
+class ParquetExport:
+    """
+        Collects dataframes of tables loaded without errors and writes every table as Parquet at the end of the run,
+        launch table is partitioned by launch year (launch/launch_year=1957/...)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = {table: [] for table in TABLE_COLUMNS}
+        self.pending = {table: [] for table in TABLE_COLUMNS}
+
+    def add(self, table_name, dataframe):
+        self.pending[table_name].append(dataframe)
+
+    def page_done(self):
+        for table, frames in self.pending.items():
+            self.frames[table] += frames
+            frames.clear()
+
+    def page_failed(self):
+        for frames in self.pending.values():
+            frames.clear()
+
+    def write(self):
+        """Writes the tables, replacing files of the previous export"""
+        makedirs(self.path, exist_ok=True)
+        for table, frames in self.frames.items():
+            if not frames:
+                continue
+            df = pd.concat(frames, ignore_index=True).drop_duplicates(subset=[TABLE_KEYS[table]], keep='last')
+            df = df.drop(columns='row_hash')  # Used by the loader only
+            if table == 'launch':
+                df['launch_year'] = df['launch_time'].dt.year
+                rmtree(f'{self.path}/launch', ignore_errors=True)
+                with metrics.timer('export', table):
+                    df.to_parquet(f'{self.path}/launch', index=False, partition_cols=['launch_year'])
+            else:
+                with metrics.timer('export', table):
+                    df.to_parquet(f'{self.path}/{table}.parquet', index=False)
+            metrics.count('rows_exported', table, len(df))
+            print(f"Table {table} exported to {self.path} successfully")
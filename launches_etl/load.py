@@ -0,0 +1,322 @@
+"""Loading of transformed dataframes to the database"""
+import pandas as pd
+import numpy as np
+from psycopg2 import DatabaseError
+from psycopg2.extras import execute_batch
+from threading import local
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from json import dumps, loads
+
+from .db import get_db_pool
+from .metrics import metrics
+from .schema import TABLES, TABLE_COLUMNS, TABLE_KEYS, TABLE_LOAD_ORDER, get_partition_column
+from .settings import PARTITION_INTERVAL, TABLE_LOAD_WORKERS
+from .transform import validate_df
+
+
+def create_partitions(table_name, dataframe, cur):
+    """Creates partitions for years (or decades) of the partition column in a dataframe which don't exist yet"""
+    step = 10 if PARTITION_INTERVAL == 'decade' else 1
+    years = dataframe[get_partition_column(table_name)].dt.year
+    starts = sorted({int(year) // step * step for year in years.dropna().unique()})
+    names = {start: f"{table_name}_{start}{'s' if step == 10 else ''}" for start in starts}
+    cur.execute("SELECT relname FROM pg_class WHERE relname = ANY(%s)", (list(names.values()),))
+    existing = {name for (name,) in cur.fetchall()}
+    for start, name in names.items():
+        if name in existing:
+            continue
+        cur.execute(f"""
+        CREATE TABLE {name} PARTITION OF {table_name}
+        FOR VALUES FROM ('{start:04d}-01-01') TO ('{start + step:04d}-01-01')
+        """)
+        metrics.count('partitions_created', table_name)
+        print(f"Partition {name} created successfully")
+
+
+def quarantine_rows(table_name, df, reasons, cur):
+    """Saves invalid rows with their reasons to the quarantine table (kept between runs) instead of loading them"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS quarantine
+    (
+    quarantine_id serial PRIMARY KEY,
+    table_name VARCHAR(63),
+    row_key TEXT,
+    row_data JSONB,
+    reason TEXT,
+    quarantined_at TIMESTAMP DEFAULT now()
+    );
+    """)
+    rows = loads(df.to_json(orient='records', date_format='iso'))
+    for column, values in df.attrs.get('unconverted', {}).items():  # Values as they came from the API, not NULL
+        for row, index in zip(rows, df.index):
+            row[column] = values.get(index, row[column])
+    key = TABLE_KEYS[table_name]
+    execute_batch(cur, "INSERT INTO quarantine (table_name, row_key, row_data, reason) VALUES (%s, %s, %s, %s)",
+                  [(table_name, str(row[key]), dumps(row), reason) for row, reason in zip(rows, reasons)])
+    metrics.count('rows_quarantined', table_name, len(df))
+    print(f"{len(df)} invalid rows of {table_name} table were quarantined")
+
+
+def without_time_zones(dataframe):
+    """Converts timestamps with a time zone to UTC without it, as TIMESTAMP columns store them"""
+    zoned = [column for column, dtype in dataframe.dtypes.items() if isinstance(dtype, pd.DatetimeTZDtype)]
+    if not zoned:
+        return dataframe
+    return dataframe.assign(**{column: dataframe[column].dt.tz_convert(None) for column in zoned})
+
+
+def batch_rows(dataframe):
+    """
+        Returns rows of a dataframe as tuples of Python values for execute_batch, NULLs of typed columns become None.
+        Timestamps are sent as ISO strings, psycopg2 adapts them several times faster than Timestamp objects
+    """
+    columns = []
+    for _, series in dataframe.items():
+        if series.dtype.kind == 'M':
+            values = series.to_numpy(dtype='datetime64[us]')  # In UTC without the time zone
+            columns.append(np.where(np.isnat(values), None, np.datetime_as_string(values).astype(object)))
+        else:
+            columns.append(series.to_numpy(dtype=object, na_value=None))
+    return list(zip(*columns))
+
+
+def conflict_clause(table_name, on_conflict='nothing'):
+    """
+        Returns ON CONFLICT clause: 'nothing' keeps rows already stored, 'update' overwrites them with new values.
+        Rows with the same row_hash are not updated, so they aren't counted as changed.
+        The conflict target of a partitioned table includes its partition column, as its unique keys do
+    """
+    key = TABLE_KEYS[table_name]
+    target = [key, get_partition_column(table_name)] if get_partition_column(table_name) else [key]
+    if on_conflict == 'update' and key in TABLE_COLUMNS[table_name]:
+        columns = [column for column in TABLE_COLUMNS[table_name] if column not in target]
+        updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in columns)
+        return (f"ON CONFLICT ({', '.join(target)}) DO UPDATE SET {updates} "
+                f"WHERE {table_name}.row_hash IS DISTINCT FROM EXCLUDED.row_hash")
+    return "ON CONFLICT DO NOTHING"
+
+
+def copying_data(table_name, dataframe, cur, on_conflict='nothing'):
+    """
+        1. Writes a dataframe to an in-memory CSV buffer;
+        2. Streams the buffer to a temporary staging table with COPY FROM STDIN;
+        3. Moves rows from the staging table to the SQL table (ON CONFLICT DO NOTHING or DO UPDATE)
+    """
+    columns = ', '.join(TABLE_COLUMNS[table_name])
+    key = TABLE_KEYS[table_name]
+    partition_column = get_partition_column(table_name)
+    conflict = conflict_clause(table_name, on_conflict)
+    # DO UPDATE can't change the same row twice in one statement, so repeated keys of a page are merged first
+    distinct = f'DISTINCT ON ({key}) ' if 'DO UPDATE' in conflict else ''
+    staging_table = f'{table_name}_staging'
+
+    buffer = StringIO()
+    # NULLs of typed columns (NA, NaN, NaT) are written as empty fields, which COPY reads as NULL
+    without_time_zones(dataframe).to_csv(buffer, index=False, header=False, float_format='%.15g')
+    buffer.seek(0)
+
+    # The staging table is created once per connection and emptied after each use, creating and dropping it
+    # for every table of every page cost more catalog work than the COPY saved
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging_table} AS SELECT {columns} FROM {table_name} WITH NO DATA")
+    cur.copy_expert(f"COPY {staging_table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+    where = ''
+    if partition_column is not None and distinct:
+        # A launch moved to another year is updated in place first (postgres moves the row to its new partition),
+        # otherwise it would be inserted next to the old row, as the conflict target includes the partition column
+        cur.execute(f"""
+        UPDATE {table_name} SET {partition_column} = s.{partition_column}
+        FROM (SELECT DISTINCT ON ({key}) {key}, {partition_column} FROM {staging_table}) s
+        WHERE {table_name}.{key} = s.{key} AND {table_name}.{partition_column} IS DISTINCT FROM s.{partition_column}
+        """)
+    elif partition_column is not None:  # Stored rows are kept even when their partition column has changed
+        where = f'WHERE NOT EXISTS (SELECT 1 FROM {table_name} t WHERE t.{key} = {staging_table}.{key})'
+    cur.execute(f"""
+    INSERT INTO {table_name} ({columns})
+    SELECT {distinct}{columns} FROM {staging_table} {where} {conflict}
+    """)
+    rows_written = cur.rowcount
+    cur.execute(f"TRUNCATE {staging_table}")
+    return rows_written
+
+
+def inserting_data(table_name, dataframe, conn, cur, method='copy', on_conflict='nothing', hash_cache=None):
+    """
+        Inserts data with COPY through a staging table ('copy') or using tuples (rows) with execute_batch ('batch').
+        Rows already stored are kept (on_conflict='nothing') or overwritten (on_conflict='update').
+        Rows with the same hash in hash_cache (stored in the DB or sent earlier in the run) are skipped.
+        Returns the number of rows inserted or updated, None when the insert failed
+    """
+    if hash_cache is not None:
+        dataframe = hash_cache.new_rows(table_name, dataframe)
+        if dataframe.empty:
+            print(f"No new or changed rows for {table_name} table\n")
+            return 0
+
+    with metrics.timer('insert', table_name), metrics.profile('insert'):
+        try:
+            cur.execute("SAVEPOINT table_load")
+            if get_partition_column(table_name) is not None:
+                create_partitions(table_name, dataframe, cur)
+            # Only the staging table path handles rows moved to another partition
+            if method == 'copy' or get_partition_column(table_name) is not None:
+                rows_written = copying_data(table_name, dataframe, cur, on_conflict)
+            else:
+                tuples = batch_rows(dataframe)
+                conflict = conflict_clause(table_name, on_conflict)
+
+                columns = TABLE_COLUMNS[table_name]
+                statement = f"""
+                INSERT INTO {table_name}
+                ({', '.join(columns)})
+                VALUES ({','.join(['%s'] * len(columns))}) {conflict};
+                """
+                execute_batch(cur, statement, tuples, page_size=100)
+
+                rows_written = len(tuples)  # execute_batch doesn't report rows skipped by ON CONFLICT
+
+            cur.execute("RELEASE SAVEPOINT table_load")
+            if hash_cache is not None:
+                hash_cache.add(table_name, dataframe)
+            metrics.count('rows_sent', table_name, len(dataframe))
+            metrics.count('rows_written', table_name, rows_written)
+            print(f"Data was inserted to {table_name} table successfully\n")
+            return rows_written
+        except (Exception, DatabaseError) as error:
+            print(f"Error: {error}")
+            cur.execute("ROLLBACK TO SAVEPOINT table_load")  # Discards only this table, not the whole transaction
+            cur.execute("RELEASE SAVEPOINT table_load")
+            metrics.count('insert_errors', table_name)
+            return None
+
+
+class TableLoader:
+    """
+        Loads tables of one level of TABLE_LOAD_ORDER at the same time, each table in its own thread
+        over its own connection. A table is committed as soon as it's loaded, so tables depending on it see its rows
+    """
+
+    def __init__(self, workers=TABLE_LOAD_WORKERS):
+        self.pool = get_db_pool(workers)
+        self.executor = ThreadPoolExecutor(workers)
+        self.connections = local()
+
+    def connection(self):
+        """Returns the connection and cursor of the current thread"""
+        if not hasattr(self.connections, 'conn'):
+            self.connections.conn = self.pool.getconn()
+            self.connections.cur = self.connections.conn.cursor()
+        return self.connections.conn, self.connections.cur
+
+    def insert(self, table_name, dataframe, on_conflict, hash_cache):
+        conn, cur = self.connection()
+        try:
+            rows_written = inserting_data(table_name, dataframe, conn, cur, on_conflict=on_conflict,
+                                          hash_cache=hash_cache)
+            with metrics.timer('commit', table_name):
+                conn.commit()
+            return rows_written
+        except Exception:
+            conn.rollback()
+            raise
+
+    def load(self, tables, dataframes, on_conflict='nothing', hash_cache=None):
+        """Returns rows written per table"""
+        futures = {table: self.executor.submit(self.insert, table, dataframes[table], on_conflict, hash_cache)
+                   for table in tables}
+        return {table: future.result() for table, future in futures.items()}
+
+    def close(self):
+        self.executor.shutdown()
+        self.pool.closeall()
+
+
+class HashCache:
+    """
+        Row hashes (key -> hash) of rows stored in the DB or sent during the run, so only new and changed rows are sent.
+        Hashes of a page are kept aside until the page is loaded, so a failed page doesn't leave them in the cache
+    """
+
+    def __init__(self, tables=TABLES):
+        self.hashes = {table: {} for table in tables}
+        self.pending = {table: {} for table in tables}
+
+    def load(self, cur):
+        """Fills the cache with hashes of rows already stored in the DB (resumed runs, refreshes and syncs)"""
+        cur.execute("SELECT table_name FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND column_name = 'row_hash'")
+        hashed = {table for (table,) in cur.fetchall()}
+        for table in self.hashes:
+            if table not in hashed:  # Tables created before row hashes were added, their rows are rewritten once
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN row_hash BIGINT")
+            cur.execute(f"SELECT {TABLE_KEYS[table]}, row_hash FROM {table} WHERE row_hash IS NOT NULL")
+            self.hashes[table].update(cur.fetchall())
+        cur.connection.commit()  # Releases locks of the tables, so connections of TableLoader can write to them
+
+    def new_rows(self, table_name, dataframe):
+        """Returns rows with new keys or changed hashes, counts new, updated and unchanged rows of the table"""
+        hashes = self.hashes[table_name]
+        stored = pd.array([hashes.get(key) for key in dataframe[TABLE_KEYS[table_name]]], dtype='Int64')
+        new = stored.isna()
+        changed = (stored != dataframe['row_hash'].to_numpy()).to_numpy(dtype=bool, na_value=False)  # NA - new
+        metrics.count('rows_new', table_name, int(new.sum()))
+        metrics.count('rows_updated', table_name, int(changed.sum()))
+        metrics.count('rows_unchanged', table_name, int(len(dataframe) - new.sum() - changed.sum()))
+        return dataframe[new | changed]
+
+    def add(self, table_name, dataframe):
+        self.pending[table_name].update(zip(dataframe[TABLE_KEYS[table_name]], dataframe['row_hash']))
+
+    def page_done(self):
+        for table, hashes in self.pending.items():
+            self.hashes[table].update(hashes)
+            hashes.clear()
+
+    def page_failed(self):
+        for hashes in self.pending.values():
+            hashes.clear()
+
+
+def validate_page(cur, dataframes, hash_cache=None):
+    """
+        Validates dataframes of a page level by level of TABLE_LOAD_ORDER, so foreign keys are checked against
+        valid rows of the referenced tables in the page and keys already loaded (from hash_cache).
+        Invalid rows are quarantined. Returns dataframes of valid rows
+    """
+    valid = {}
+    for level in TABLE_LOAD_ORDER:
+        for table in level:
+            references = {}
+            for reference in TABLES[table].get('foreign_keys', {}).values():
+                referenced_table = reference.split()[0]
+                references[referenced_table] = [valid[referenced_table][TABLE_KEYS[referenced_table]]]
+                if hash_cache is not None:
+                    references[referenced_table].append(list(hash_cache.hashes[referenced_table]))
+            with metrics.timer('validate', table):
+                valid[table], reasons = validate_df(table, dataframes[table], references)
+            if len(reasons):
+                quarantine_rows(table, dataframes[table].loc[reasons.index], reasons, cur)
+    return valid
+
+
+def load_tables(conn, cur, dataframes, on_conflict='nothing', hash_cache=None, loader=None):
+    """
+        Inserts dataframes of a page level by level of TABLE_LOAD_ORDER. Tables of a level are loaded at the same time
+        by the loader (if given), the others over the connection of the run.
+        Raises when a table failed to load and tables depending on it are left.
+        Returns rows written per table, None for tables which failed to load
+    """
+    written = {}
+    for level in TABLE_LOAD_ORDER:
+        failed = {table for table, rows in written.items() if rows is None}
+        dependents = [table for table in level if failed.intersection(TABLES[table].get('depends_on', []))]
+        if dependents:  # Foreign keys are added after the load, so the rows would be orphans breaking build_indexes
+            raise RuntimeError(f"Tables {', '.join(sorted(failed))} failed to load, "
+                               f"so {', '.join(dependents)} can't be loaded and the page is discarded")
+        if loader is not None and len(level) > 1:
+            written.update(loader.load(level, dataframes, on_conflict, hash_cache))
+        else:
+            for table in level:
+                written[table] = inserting_data(table, dataframes[table], conn, cur, on_conflict=on_conflict,
+                                                hash_cache=hash_cache)
+    return written
@@ -0,0 +1,174 @@
+"""Timers and counters of a run, saved as a JSON report and a Prometheus textfile"""
+from time import localtime, strftime, perf_counter, time
+from os import makedirs, replace, listdir
+from os.path import exists
+from threading import Lock, current_thread, main_thread
+from json import dumps, loads
+from collections import defaultdict
+from contextlib import contextmanager
+from cProfile import Profile
+from pstats import Stats
+import tracemalloc
+
+from .settings import METRICS_PATH, PROFILE, PROFILED_STAGES
+
+
+class ProfileSnapshot:
+    """cProfile stats of a transform process, pstats reads them like a profiler"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class Metrics:
+    """
+        Timers and counters of pipeline stages, labeled with a table name where a stage runs per table.
+        Written at the end of a run as a JSON report and a Prometheus textfile
+    """
+
+    def __init__(self):
+        self.started = time()
+        self.timers = defaultdict(lambda: [0, 0.0, 0.0])  # (stage, table) -> [calls, total seconds, max seconds]
+        self.counters = defaultdict(int)  # (name, table) -> value
+        self.peaks = defaultdict(int)  # stage -> peak traced memory in bytes (PROFILE = 'tracemalloc')
+        self.profiler = Profile() if PROFILE == 'cprofile' else None
+        self.profile_stats = Stats()  # cProfile stats of the run, transform processes add theirs with each page
+        self.lock = Lock()  # Pages are fetched in other threads
+
+    @contextmanager
+    def timer(self, stage, table=''):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            with self.lock:
+                timer = self.timers[(stage, table)]
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def count(self, name, table='', value=1):
+        with self.lock:
+            self.counters[(name, table)] += value
+
+    def drain(self):
+        """
+            Returns timers, counters, memory peaks and cProfile stats and clears them,
+            transform processes send them back with each page
+        """
+        with self.lock:
+            timers, counters, peaks = dict(self.timers), dict(self.counters), dict(self.peaks)
+            self.timers.clear()
+            self.counters.clear()
+            self.peaks.clear()
+            profile_stats = None
+            if self.profiler is not None:
+                self.profiler.create_stats()
+                profile_stats = self.profiler.stats
+                self.profiler = Profile()  # Stats of a profiler add up, so the next page starts a new one
+        return timers, counters, peaks, profile_stats
+
+    def merge(self, timers, counters, peaks, profile_stats):
+        """Adds timers, counters, memory peaks and cProfile stats of a transform process"""
+        with self.lock:
+            for key, (calls, total, longest) in timers.items():
+                timer = self.timers[key]
+                timer[0] += calls
+                timer[1] += total
+                timer[2] = max(timer[2], longest)
+            for key, value in counters.items():
+                self.counters[key] += value
+            for stage, peak in peaks.items():
+                self.peaks[stage] = max(self.peaks[stage], peak)
+            if profile_stats:
+                self.profile_stats.add(ProfileSnapshot(profile_stats))
+
+    @contextmanager
+    def profile(self, stage):
+        """
+            Profiles hot stages with cProfile or records their peak memory with tracemalloc.
+            Only the main thread is profiled: one profiler can be active at a time and tracemalloc traces the process,
+            so stages running in threads at the same time (TableLoader) would break each other's numbers
+        """
+        if stage not in PROFILED_STAGES or PROFILE is None or current_thread() is not main_thread():
+            yield
+        elif PROFILE == 'cprofile':
+            self.profiler.enable()
+            try:
+                yield
+            finally:
+                self.profiler.disable()
+        elif PROFILE == 'tracemalloc':
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            try:
+                yield
+            finally:
+                self.peaks[stage] = max(self.peaks[stage], tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+
+    def report(self):
+        return {
+            'started': strftime('%Y-%m-%dT%H:%M:%S', localtime(self.started)),
+            'seconds': round(time() - self.started, 3),
+            'stages': [{'stage': stage, 'table': table, 'calls': calls, 'seconds': round(total, 6),
+                        'max_seconds': round(longest, 6)}
+                       for (stage, table), (calls, total, longest) in sorted(self.timers.items())],
+            'counters': [{'name': name, 'table': table, 'value': value}
+                         for (name, table), value in sorted(self.counters.items())],
+            'peak_memory_bytes': dict(self.peaks)
+        }
+
+    def prometheus(self):
+        lines = []
+        for position, (metric, metric_type) in enumerate([('stage_calls_total', 'counter'),
+                                                          ('stage_seconds_total', 'counter'),
+                                                          ('stage_max_seconds', 'gauge')]):
+            lines.append(f'# TYPE launches_etl_{metric} {metric_type}')  # Samples of a metric are kept together
+            for (stage, table), timer in sorted(self.timers.items()):
+                lines.append(f'launches_etl_{metric}{{stage="{stage}",table="{table}"}} {timer[position]:g}')
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f'# TYPE launches_etl_{name}_total counter')
+            for (counter, table), value in sorted(self.counters.items()):
+                if counter == name:
+                    lines.append(f'launches_etl_{name}_total{{table="{table}"}} {value}')
+        lines.append('# TYPE launches_etl_last_run_timestamp_seconds gauge')
+        lines.append(f'launches_etl_last_run_timestamp_seconds {time():.0f}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, run_name):
+        """Writes the JSON report of the run, the Prometheus textfile and cProfile stats"""
+        makedirs(METRICS_PATH, exist_ok=True)
+        file_name = f"{run_name}_{strftime('%Y%m%dT%H%M%S', localtime(self.started))}"
+        with open(f'{METRICS_PATH}/{file_name}.json', 'w') as f:
+            f.write(dumps(self.report(), indent=2))
+        with open(f'{METRICS_PATH}/launches_etl.prom.tmp', 'w') as f:
+            f.write(self.prometheus())
+        replace(f'{METRICS_PATH}/launches_etl.prom.tmp', f'{METRICS_PATH}/launches_etl.prom')  # Never half-written
+        if self.profiler is not None:
+            self.profiler.create_stats()
+            if self.profiler.stats:
+                self.profile_stats.add(self.profiler)
+            self.profile_stats.dump_stats(f'{METRICS_PATH}/{file_name}.prof')
+        print(f"Metrics saved to {METRICS_PATH}/{file_name}.json")
+
+
+metrics = Metrics()
+
+
+def get_reports(run_name=None, limit=None):
+    """Returns (file name, report) of the latest 'limit' saved JSON reports, only of 'run_name' runs if it's given"""
+    if not exists(METRICS_PATH):
+        return []
+    file_names = sorted((file_name for file_name in listdir(METRICS_PATH) if file_name.endswith('.json')
+                         and (run_name is None or file_name.rsplit('_', 1)[0] == run_name)),
+                        key=lambda file_name: file_name.rsplit('_', 1)[1], reverse=True)
+    reports = []
+    for file_name in file_names[:limit]:
+        with open(f'{METRICS_PATH}/{file_name}') as f:
+            reports.append((file_name, loads(f.read())))
+    return reports
@@ -0,0 +1,251 @@
+"""Runs of the pipeline: a full load from the API, syncs and replays of saved pages"""
+from os import remove
+from threading import Thread
+from queue import Queue
+
+from .api import ApiClient, TokenBucket, get_page_url, fetch_pages
+from .db import DBConnection, get_db_pool
+from .export import ParquetExport
+from .load import TableLoader, HashCache, validate_page, load_tables
+from .metrics import metrics
+from .schema import TABLES, recreate_tables, build_indexes, create_views, refresh_views
+from .settings import (COMMIT_EVERY, PAGE_SIZE, PAGE_QUEUE_SIZE, TABLE_LOAD_WORKERS, TRANSFORM_WORKERS,
+                       CHECKPOINT_PATH, PARQUET_PATH, SEGMENT_SUFFIX)
+from .store import (create_segment, append_page, read_segment, read_checkpoint, write_checkpoint, get_json_files,
+                    read_json_files)
+from .transform import extract_tables, create_df, transform_df, transformed_pages
+
+
+def process_page(conn, cur, tables, on_conflict='nothing', hash_cache=None, export=None, dataframes=None,
+                 loader=None):
+    """
+        Populates the tables with one page of data.
+        Dataframes already transformed by transform_page (tables is None then) are only inserted.
+        Returns names of tables where rows were inserted or updated
+    """
+    with metrics.timer('page'):
+        if dataframes is None:
+            dataframes = {table: transform_df(f'{table}_df', create_df(f'{table}_df', tables)) for table in TABLES}
+        dataframes = validate_page(cur, dataframes, hash_cache)
+        written = load_tables(conn, cur, dataframes, on_conflict, hash_cache, loader)
+        if export is not None:  # Rows of tables which failed to load are not in the DB, so they aren't exported
+            for table, dataframe in dataframes.items():
+                if written[table] is not None:
+                    export.add(table, dataframe)
+
+    return {table for table, rows in written.items() if rows}
+
+
+def replay(path='./json_files', commit_every=COMMIT_EVERY, transform_workers=TRANSFORM_WORKERS,
+           refresh=False):
+    """
+        Rebuilds the database without calling the API from a raw store segment or a folder of saved JSON files.
+        With refresh=True the pages are upserted into the existing tables instead, writing only new and changed rows.
+        Pages are transformed by 'transform_workers' processes, this thread is the only one writing to the DB.
+        Returns False when building indexes or refreshing views failed
+    """
+    if path.endswith(SEGMENT_SUFFIX):
+        pages = read_segment(path)
+    else:
+        pages = read_json_files(get_json_files(path))
+    db = DBConnection(get_db_pool(), commit_every)
+    loader = TableLoader() if TABLE_LOAD_WORKERS and commit_every == 1 else None
+    hash_cache = HashCache()
+    export = ParquetExport(PARQUET_PATH) if PARQUET_PATH else None
+    changed_tables = set()
+    completed = False
+    succeeded = True
+    try:
+        if refresh:
+            hash_cache.load(db.cur)
+        else:  # Tables are recreated before the pages, so a failed first page doesn't leave the old ones
+            recreate_tables(db.cur)
+            if loader is not None:  # Connections of the loader see the tables only when they are committed
+                db.conn.commit()
+        for it_done, (dataframes, error) in enumerate(transformed_pages(pages, transform_workers)):
+            try:
+                db.start_page()
+                if error is not None:  # The page failed to transform
+                    raise error
+                changed_tables |= process_page(db.conn, db.cur, None, 'update' if refresh else 'nothing', hash_cache,
+                                               export, dataframes, loader)
+
+            except Exception as e:
+                print(e)
+                db.page_failed(e)
+                hash_cache.page_failed()
+                if export is not None:
+                    export.page_failed()
+            db.page_done()
+            hash_cache.page_done()
+            if export is not None:
+                export.page_done()
+            print(f"ITERATIONS DONE: {it_done + 1}")
+        if refresh:
+            succeeded = refresh_views(db.cur, changed_tables)
+        else:  # After DB population it creates foreign keys, indexes and views, even when the last page failed
+            succeeded = build_indexes(db.cur)
+            create_views(db.cur)
+        completed = True
+    finally:
+        db.close(commit=completed)
+        if loader is not None:
+            loader.close()
+    if export is not None:
+        export.write()
+    metrics.write('load' if refresh else 'replay')
+    return succeeded
+
+
+def sync(commit_every=COMMIT_EVERY):
+    """
+        Upserts only launches updated in the API since the last run, tables, indexes and views are kept.
+        Returns False when the launch table is empty or refreshing views failed
+    """
+    db = DBConnection(get_db_pool(), commit_every)
+    loader = TableLoader() if TABLE_LOAD_WORKERS and commit_every == 1 else None
+    hash_cache = HashCache()
+    completed = False
+    try:
+        db.cur.execute("SELECT max(last_updated_api) FROM launch")
+        last_updated = db.cur.fetchone()[0]
+        if last_updated is None:
+            print("Table launch is empty, run the full load first")
+            completed = True
+            return False
+        hash_cache.load(db.cur)
+        api_endpoint = get_page_url(0, last_updated__gte=last_updated.strftime('%Y-%m-%dT%H:%M:%SZ'))
+        client = ApiClient(TokenBucket())
+        segment_path = create_segment()
+        it_done = 0
+        changed_tables = set()
+        while api_endpoint is not None:
+
+            print(api_endpoint)
+            data = client.get_json(api_endpoint)
+            tables = extract_tables(data['results'])
+
+            append_page(segment_path, data['results'])
+            try:
+                db.start_page()
+                if len(data['results']):
+                    changed_tables |= process_page(db.conn, db.cur, tables, on_conflict='update',
+                                                   hash_cache=hash_cache, loader=loader)
+
+            except Exception as e:
+                print(e)
+                db.page_failed(e)
+                hash_cache.page_failed()
+            db.page_done()
+            hash_cache.page_done()
+            api_endpoint = data['next']
+            it_done += 1
+            print(f"ITERATIONS DONE: {it_done}, LAUNCHES UPDATED: {len(data['results'])}")
+        succeeded = refresh_views(db.cur, changed_tables)
+        completed = True
+    finally:
+        db.close(commit=completed)
+        if loader is not None:
+            loader.close()
+        metrics.write('sync')
+    return succeeded
+
+
+def fetch(commit_every=COMMIT_EVERY, workers=1):
+    """
+        Loads every launch from the API:
+        1. Page offsets are computed from the number of launches in the first response;
+        2. 'workers' threads fetch pages through ApiClient (token bucket, cache, retries),
+           while the main thread loads them to the DB;
+        3. Offsets of committed pages are saved to the checkpoint, so an interrupted run resumes where it stopped.
+        Returns False when building indexes or refreshing views failed
+    """
+    checkpoint = read_checkpoint()
+    client = ApiClient(TokenBucket())
+    page_queue = Queue(maxsize=PAGE_QUEUE_SIZE + 1)
+    if checkpoint is None:
+        data = client.get_json(get_page_url(0))
+        count, offsets_done = data['count'], []
+        page_queue.put((0, data))  # The first page is loaded without requesting it once again
+        segment_path = create_segment()
+    else:
+        count, offsets_done = checkpoint['count'], checkpoint['offsets_done']
+        segment_path = checkpoint['segment']  # Pages of a resumed run are appended to the same segment
+        print(f"Resuming from the checkpoint: {len(offsets_done)} pages are already loaded")
+
+    offsets = [offset for offset in range(0, count, PAGE_SIZE) if offset not in offsets_done]
+    offset_queue = Queue()
+    for offset in offsets[1 if checkpoint is None else 0:]:
+        offset_queue.put(offset)
+    for _ in range(workers):
+        Thread(target=fetch_pages, args=(offset_queue, page_queue, client), daemon=True).start()
+
+    it_done = 0
+    workers_done = 0
+    offsets_pending = []  # Pages loaded but not committed yet
+    changed_tables = set()
+    db = DBConnection(get_db_pool(), commit_every)
+    loader = TableLoader() if TABLE_LOAD_WORKERS and commit_every == 1 else None
+    hash_cache = HashCache()
+    if checkpoint is not None:
+        hash_cache.load(db.cur)
+    # A resumed run has only a part of the data, so it isn't exported
+    export = ParquetExport(PARQUET_PATH) if PARQUET_PATH and checkpoint is None else None
+    completed = False
+    try:
+        if checkpoint is None:  # Tables are recreated first, so a failed first page doesn't leave the old ones
+            recreate_tables(db.cur)
+            if loader is not None:  # Connections of the loader see the tables only when they are committed
+                db.conn.commit()
+        while workers_done < workers:
+            page = page_queue.get()
+            if page is None:
+                workers_done += 1
+                continue
+            offset, data = page
+            it_done += 1
+            if data is None:
+                continue
+            tables = extract_tables(data['results'])
+
+            append_page(segment_path, data['results'])
+            try:
+                db.start_page()
+                changed_tables |= process_page(db.conn, db.cur, tables, hash_cache=hash_cache, export=export,
+                                               loader=loader)
+                offsets_pending.append(offset)
+
+            except Exception as e:
+                print(e)
+                db.page_failed(e)
+                hash_cache.page_failed()
+                if export is not None:
+                    export.page_failed()
+            hash_cache.page_done()
+            if export is not None:
+                export.page_done()
+            if db.page_done():
+                offsets_done += offsets_pending
+                offsets_pending = []
+                write_checkpoint(count, offsets_done, segment_path)
+            print(f"ITERATIONS DONE: {it_done}")
+        succeeded = build_indexes(db.cur)  # After DB population it creates foreign keys, indexes and views
+        create_views(db.cur)
+        if checkpoint is not None:  # Materialized views of the interrupted run exist, they don't have resumed pages
+            succeeded &= refresh_views(db.cur, changed_tables)
+        completed = True
+    finally:
+        db.close(commit=completed)
+        if loader is not None:
+            loader.close()
+        if completed:
+            offsets_done += offsets_pending
+            offsets_pending = []
+        write_checkpoint(count, offsets_done, segment_path)  # Pages rolled back are loaded again by the next run
+    if export is not None:
+        export.write()
+    metrics.write('fetch')
+
+    if len(offsets_done) == len(range(0, count, PAGE_SIZE)):
+        remove(CHECKPOINT_PATH)  # Every page is loaded, the next run starts from scratch
+    return succeeded
@@ -0,0 +1,369 @@
+"""Tables, indexes and views of the database"""
+from psycopg2 import DatabaseError
+
+from .metrics import metrics
+from .settings import PARTITION_INTERVAL, MATERIALIZED_VIEWS
+
+# Every SQL table of the database, adding a table is a single entry:
+# columns - column -> (SQL type, path in a launch JSON object, None for columns not read from the API);
+# key - primary key used as the conflict target when rows are upserted;
+# required - rows with NULL in these columns are dropped;
+# depends_on - tables loaded (and committed) before this one;
+# foreign_keys, indexes - added by build_indexes after the data is loaded (indexes: index name -> definition);
+# partition_by - column of range partitions when PARTITION_INTERVAL is set (NOT NULL then);
+# ranges - allowed values of numeric columns, checked with the types and lengths of columns before loading
+TABLES = {
+    'rocket': {
+        'columns': {
+            'rocket_id': ('INT PRIMARY KEY', 'rocket.id'),
+            'rocket_config_id': ('INT', 'rocket.configuration.id'),
+            'rocket_name': ('VARCHAR(255)', 'rocket.configuration.full_name'),
+            'rocket_family': ('VARCHAR(255)', 'rocket.configuration.family'),
+            'rocket_variant': ('VARCHAR(255)', 'rocket.configuration.variant')
+        },
+        'key': 'rocket_id',
+        'depends_on': []
+    },
+    'mission': {
+        'columns': {
+            'mission_id': ('INT PRIMARY KEY', 'mission.id'),
+            'mission_name': ('VARCHAR(255)', 'mission.name'),
+            'type': ('VARCHAR(255)', 'mission.type'),
+            'orbit_name': ('VARCHAR(255)', 'mission.orbit.name'),
+            'mission_description': ('TEXT', 'mission.description')
+        },
+        'key': 'mission_id',
+        'required': ['mission_id'],  # Launches without a mission
+        'depends_on': []
+    },
+    'location': {
+        'columns': {
+            'location_id': ('INT PRIMARY KEY', 'pad.location.id'),
+            'location_name': ('VARCHAR(255)', 'pad.location.name'),
+            'country_code': ('VARCHAR(5)', 'pad.location.country_code'),
+            'total_launch_count': ('INT', 'pad.location.total_launch_count'),
+            'total_landing_count': ('INT', 'pad.location.total_landing_count')
+        },
+        'key': 'location_id',
+        'depends_on': []
+    },
+    'pad': {
+        'columns': {
+            'pad_id': ('INT PRIMARY KEY', 'pad.id'),
+            'location_id': ('INT', 'pad.location.id'),
+            'pad_name': ('VARCHAR(255)', 'pad.name'),
+            'latitude': ('REAL', 'pad.latitude'),
+            'longitude': ('REAL', 'pad.longitude')
+        },
+        'key': 'pad_id',
+        'depends_on': [],
+        'ranges': {
+            'latitude': (-90, 90),
+            'longitude': (-180, 180)
+        },
+        'indexes': {
+            'pad_location_id_idx': '(location_id)'
+        }
+    },
+    'status': {
+        'columns': {
+            'status_id': ('INT PRIMARY KEY', 'status.id'),
+            'status_name': ('VARCHAR(255)', 'status.name'),
+            'status_description': ('TEXT', 'status.description')
+        },
+        'key': 'status_id',
+        'depends_on': []
+    },
+    'launch': {
+        'columns': {
+            'launch_id': ('serial PRIMARY KEY', None),  # Generated by postgres, not loaded
+            'api_launch_id': ('UUID NOT NULL UNIQUE', 'id'),
+            'launch_slug': ('VARCHAR(255) UNIQUE', 'slug'),
+            'launch_name': ('VARCHAR(255)', 'name'),
+            'rocket_id': ('INT', 'rocket.id'),
+            'mission_id': ('INT NULL', 'mission.id'),
+            'location_id': ('INT', 'pad.location.id'),
+            'pad_id': ('INT', 'pad.id'),
+            'status_id': ('INT', 'status.id'),
+            'launch_time': ('TIMESTAMP', 'net'),
+            'last_updated_api': ('TIMESTAMP', 'last_updated'),
+            'last_updated_db': ('TIMESTAMP', None)  # Added in transform_df
+        },
+        'key': 'api_launch_id',  # UUID of a launch in the API
+        'depends_on': ['rocket', 'mission', 'location', 'pad', 'status'],
+        'partition_by': 'launch_time',
+        'foreign_keys': {
+            'rocket_id': 'rocket (rocket_id)',
+            'mission_id': 'mission (mission_id) ON DELETE SET NULL',
+            'location_id': 'location (location_id)',
+            'pad_id': 'pad (pad_id)',
+            'status_id': 'status (status_id)'
+        },
+        'indexes': {
+            'launch_rocket_id_idx': '(rocket_id) INCLUDE (status_id)',
+            'launch_location_id_idx': '(location_id) INCLUDE (status_id, launch_time)',
+            'launch_status_year_idx': '(status_id, (EXTRACT(YEAR FROM launch_time)))',
+            'launch_year_idx': '((EXTRACT(YEAR FROM launch_time)))',
+            'launch_time_brin_idx': 'USING BRIN (launch_time)',
+            'launch_mission_id_idx': '(mission_id)',
+            'launch_pad_id_idx': '(pad_id)'
+        }
+    }
+}
+if PARTITION_INTERVAL:  # Unique keys of a partitioned table include its partition column, so it can't be NULL
+    for spec in TABLES.values():
+        if 'partition_by' in spec:
+            definition, path = spec['columns'][spec['partition_by']]
+            spec['columns'][spec['partition_by']] = (f'{definition} NOT NULL', path)
+# Source fields of each SQL table column: column -> path in a launch JSON object
+TABLE_FIELDS = {table: {column: path for column, (_, path) in spec['columns'].items() if path is not None}
+                for table, spec in TABLES.items()}
+# Columns of SQL tables in the same order as columns of transformed dataframes. Every table also stores
+# a hash of its row content (row_hash), so rows that haven't changed aren't written again
+TABLE_COLUMNS = {table: [column for column, (definition, _) in spec['columns'].items()
+                         if not definition.startswith('serial')] + ['row_hash']
+                 for table, spec in TABLES.items()}
+TABLE_KEYS = {table: spec['key'] for table, spec in TABLES.items()}
+TABLE_INDEXES = {table: spec.get('indexes', {}) for table, spec in TABLES.items()}
+
+
+def get_load_order(tables=TABLES):
+    """Groups tables into levels: tables of a level depend only on tables of the previous levels"""
+    levels, loaded = [], set()
+    while len(loaded) < len(tables):
+        level = [table for table, spec in tables.items()
+                 if table not in loaded and set(spec['depends_on']) <= loaded]
+        if not level:
+            raise ValueError(f"Tables with circular dependencies: {sorted(set(tables) - loaded)}")
+        levels.append(level)
+        loaded.update(level)
+    return levels
+
+
+TABLE_LOAD_ORDER = get_load_order()  # [['rocket', 'mission', 'location', 'pad', 'status'], ['launch']]
+VIEWS = {
+    'leading_country': 'leading_country_per_year_vw',
+    'rocket_family_stats': 'rocket_family_stats_vw'
+}
+VIEW_TABLES = {  # Tables used by each view, a view is refreshed only when one of them changed
+    'leading_country': ['launch', 'location'],
+    'rocket_family_stats': ['launch', 'rocket']
+}
+VIEW_KEYS = {  # Unique index of each materialized view ('total_launches' of leading_country holds country code)
+    'leading_country': '(year, total_launches)',
+    'rocket_family_stats': '(rocket_family)'
+}
+
+
+def get_view_kind(view_name, cur):
+    """Returns 'v' for a view, 'm' for a materialized view and None if the view doesn't exist"""
+    cur.execute("SELECT relkind FROM pg_class WHERE relname = %s AND relkind IN ('v', 'm')", (VIEWS[view_name],))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def drop_view(view_name, cur):
+    """Deletes a view or a materialized view when specifying its name"""
+    if get_view_kind(view_name, cur) == 'm':
+        cur.execute(f"DROP MATERIALIZED VIEW IF EXISTS {VIEWS[view_name]}")
+    else:
+        cur.execute(f"DROP VIEW IF EXISTS {VIEWS[view_name]}")
+    print(f"View {view_name} deleted successfully")
+
+
+def drop_index(index_name, cur):
+    """Deletes indexes of a table when specifying its name"""
+    for name in TABLE_INDEXES.get(index_name, {}):
+        cur.execute(f"DROP INDEX IF EXISTS {name}")
+    print(f"Index {index_name} deleted successfully")
+
+
+def drop_table(table_name, cur):
+    """Drops a table when specifying its name"""
+    cur.execute(f"DROP TABLE IF EXISTS {table_name} CASCADE")
+    print(f"Table {table_name} deleted successfully")
+
+
+def get_partition_column(table_name):
+    """Returns the column a table is partitioned by, None when the table isn't partitioned"""
+    return TABLES[table_name].get('partition_by') if PARTITION_INTERVAL else None
+
+
+def create_table(table_name, cur):
+    """
+        Creates a table when specifying its name, using its columns from TABLES.
+        Primary and unique keys of a partitioned table also include its partition column (postgres requires it)
+    """
+    partition_column = get_partition_column(table_name)
+    columns, constraints = [], []
+    for column, (definition, _) in TABLES[table_name]['columns'].items():
+        for constraint in ['PRIMARY KEY', 'UNIQUE']:
+            if partition_column is not None and constraint in definition:
+                definition = definition.replace(f' {constraint}', '')
+                constraints.append(f'{constraint} ({column}, {partition_column})')
+        columns.append(f'{column} {definition}')
+    columns.append('row_hash BIGINT')
+    partitions = f' PARTITION BY RANGE ({partition_column})' if partition_column is not None else ''
+    columns = ',\n        '.join(columns + constraints)
+    cur.execute(f"""
+        CREATE TABLE {table_name}
+        (
+        {columns}
+        ){partitions};
+        """)
+    print(f"Table {table_name} created successfully")
+
+
+def recreate_tables(cur):
+    """Deletes indexes, views and tables and creates empty tables, a full load starts from scratch"""
+    for table in TABLES:
+        drop_index(table, cur)
+    for view in VIEWS:
+        drop_view(view, cur)
+    for table in TABLES:
+        drop_table(table, cur)
+        create_table(table, cur)
+
+
+def execute_in_savepoint(statement, cur):
+    """Runs a DDL statement in its own savepoint, so a failure discards only it. Returns False when it failed"""
+    cur.execute("SAVEPOINT index_build")
+    try:
+        cur.execute(statement)
+        succeeded = True
+    except (Exception, DatabaseError) as error:
+        print(f"Error: {error}")
+        cur.execute("ROLLBACK TO SAVEPOINT index_build")  # The loaded data and other indexes are kept
+        metrics.count('build_errors')
+        succeeded = False
+    cur.execute("RELEASE SAVEPOINT index_build")
+    return succeeded
+
+
+def create_index(index_name, cur):
+    """
+        Creates secondary indexes of a table when specifying its name (primary keys are indexed by postgres).
+        Returns False when one of them failed
+    """
+    created = [execute_in_savepoint(f"CREATE INDEX IF NOT EXISTS {name} ON {index_name} {definition}", cur)
+               for name, definition in TABLE_INDEXES.get(index_name, {}).items()]
+    if all(created):
+        print(f"Index {index_name} created successfully")
+    return all(created)
+
+
+def create_foreign_keys(cur):
+    """Adds foreign keys of the tables, dropping them first so the step can be repeated. Returns False on a failure"""
+    created = []
+    for table, spec in TABLES.items():
+        for column, reference in spec.get('foreign_keys', {}).items():
+            name = f'{table}_{column}_fkey'
+            created.append(execute_in_savepoint(f"""
+            ALTER TABLE {table}
+            DROP CONSTRAINT IF EXISTS {name},
+            ADD CONSTRAINT {name} FOREIGN KEY ({column}) REFERENCES {reference}
+            """, cur))
+    if all(created):
+        print("Foreign keys created successfully")
+    return all(created)
+
+
+def build_indexes(cur):
+    """
+        Runs after the bulk load, so rows are loaded without checking foreign keys and updating indexes:
+        1. Adds foreign keys;
+        2. Creates secondary indexes;
+        3. Updates planner statistics with ANALYZE.
+        Every statement has its own savepoint, a failed one doesn't discard the others. Returns False when one failed
+    """
+    with metrics.timer('create_foreign_keys'):
+        built = create_foreign_keys(cur)
+    for table in TABLES:
+        with metrics.timer('create_index', table):
+            built &= create_index(table, cur)
+        with metrics.timer('analyze', table):
+            built &= execute_in_savepoint(f"ANALYZE {table}", cur)
+    return built
+
+
+def create_view(view_name, cur, materialized=None):
+    """Creates a view or a materialized view with a unique index (needed for REFRESH CONCURRENTLY)"""
+    if materialized is None:
+        materialized = MATERIALIZED_VIEWS
+    create = 'CREATE MATERIALIZED VIEW IF NOT EXISTS' if materialized else 'CREATE OR REPLACE VIEW'
+    if view_name == 'leading_country':
+        cur.execute(f"""
+        {create} leading_country_per_year_vw
+        (year, total_launches, leading_country)
+        AS
+        SELECT 
+            year, 
+            country_code,
+            country_launches
+        FROM (
+            SELECT 
+                EXTRACT(YEAR FROM launch.launch_time) AS year,
+                location.country_code AS country_code,
+                COUNT(*) AS country_launches,
+                RANK() OVER (PARTITION BY EXTRACT(YEAR FROM launch.launch_time) ORDER BY COUNT(*) DESC) AS rank
+            FROM launch
+            INNER JOIN location ON launch.location_id = location.location_id
+            WHERE  launch.status_id IN (3,4,7)
+            GROUP BY 1, 2
+        ) AS t
+        WHERE rank = 1
+        ORDER BY 1
+        """)
+    elif view_name == 'rocket_family_stats':
+        cur.execute(f"""
+        {create} rocket_family_stats_vw 
+        (rocket_family, total_launches, successful_launches, failed_launches, success_rate) 
+        AS
+        SELECT r.rocket_family,
+        count(la.*) FILTER (WHERE la.status_id IN (3, 4, 7)) AS total_launches,
+        count(la.*) FILTER (WHERE la.status_id = 3) AS successful_launches,
+        count(la.*) FILTER (WHERE la.status_id IN (4, 7)) AS failed_launches,
+        count(la.*) FILTER (WHERE la.status_id = 3) * 100 / NULLIF(count(la.*) FILTER 
+        (WHERE la.status_id IN (3, 4, 7)), 0) AS success_rate
+        FROM rocket r
+        JOIN launch la ON r.rocket_id = la.rocket_id
+        GROUP BY r.rocket_family
+        ORDER BY 2 DESC
+        """)
+    if materialized:
+        cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {VIEWS[view_name]}_key_idx ON {VIEWS[view_name]} "
+                    f"{VIEW_KEYS[view_name]}")
+    print(f"View {view_name} created successfully")
+
+
+def create_views(cur):
+    """Creates every view of VIEWS"""
+    for view in VIEWS:
+        with metrics.timer('create_view', view):
+            create_view(view, cur)
+
+
+def refresh_views(cur, changed_tables=None):
+    """
+        Refreshes materialized views built upon changed tables (all of them if changed_tables is None).
+        CONCURRENTLY keeps the old rows readable while the view is refreshed. Returns False when a refresh failed
+    """
+    refreshed = True
+    for view_name, tables in VIEW_TABLES.items():
+        if get_view_kind(view_name, cur) != 'm':
+            continue
+        if changed_tables is not None and not changed_tables.intersection(tables):
+            print(f"View {view_name} is up to date")
+            continue
+        cur.execute("SAVEPOINT view_refresh")
+        try:
+            with metrics.timer('refresh_view', view_name):
+                cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {VIEWS[view_name]}")
+            print(f"View {view_name} refreshed successfully")
+        except (Exception, DatabaseError) as error:
+            print(f"Error: {error}")
+            cur.execute("ROLLBACK TO SAVEPOINT view_refresh")  # The other views are still refreshed
+            metrics.count('refresh_errors')
+            refreshed = False
+        cur.execute("RELEASE SAVEPOINT view_refresh")
+    return refreshed
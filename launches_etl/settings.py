@@ -0,0 +1,32 @@
+"""Settings of the pipeline, edit them here"""
+from os import cpu_count
+
+# 'year' or 'decade': tables with 'partition_by' (launch) are partitioned by its range, partitions are created
+# when a page has launches of a new year. None - one heap table
+PARTITION_INTERVAL = None
+MATERIALIZED_VIEWS = False  # Creates views as materialized views, dashboards then read precomputed rows
+# Connections loading tables of one level (the dimension tables) at the same time, each table is committed as soon
+# as it's loaded, so a failed page keeps its dimension rows. Used only when pages are committed one by one
+# (COMMIT_EVERY = 1). 0 - every table is loaded over the connection of the run inside the page transaction
+TABLE_LOAD_WORKERS = 0
+COMMIT_EVERY = 1  # Number of pages loaded per transaction, 0 - the whole run is loaded in one transaction
+PAGE_SIZE = 100  # Launches per API request
+API_REQUESTS_PER_HOUR = 13  # The free tier allows 15 requests / hour, a paid tier can go faster
+API_BURST = 1  # Number of requests that can be sent at once before waiting for the rate limit
+PAGE_QUEUE_SIZE = 4  # Fetched pages waiting to be loaded to the DB
+# Processes transforming replayed pages, 0 - pages are transformed by the loader itself. One core is left to the loader,
+# and inserting a page takes longer than transforming it, so more than two workers don't speed up the load
+TRANSFORM_WORKERS = min((cpu_count() or 1) - 1, 2)
+TRANSFORM_QUEUE_SIZE = 8  # Transformed pages waiting to be loaded to the DB
+CHECKPOINT_PATH = './checkpoint.json'
+HTTP_CACHE_PATH = './http_cache'  # Responses with ETag / Last-Modified for conditional requests, one file per URL
+HTTP_TIMEOUT = 30  # Seconds
+HTTP_RETRIES = 5  # Retries of 429 / 5xx responses and connection errors
+HTTP_BACKOFF = 10  # Seconds before the first retry, doubled on each next one (with jitter) unless Retry-After is sent
+RAW_STORE_PATH = './raw_store'  # Compressed pages of every run, one segment per run
+SEGMENT_SUFFIX = '.jsonl.gz'
+METRICS_PATH = './metrics'  # JSON report of every run and a textfile for Prometheus node_exporter
+PROFILE = None  # 'cprofile' or 'tracemalloc' to profile PROFILED_STAGES
+PROFILED_STAGES = ['extract', 'insert']
+PARQUET_PATH = None  # A folder, e.g. './parquet', where full loads also export the tables as Parquet (needs pyarrow)
+INDEX_SUFFIX = '.index'
@@ -0,0 +1,101 @@
+"""Pages saved on the local storage: raw store segments, JSON files and the checkpoint"""
+from time import localtime, strftime
+from os import listdir, makedirs
+from os.path import exists
+from json import dumps, loads
+from gzip import compress, decompress
+from mmap import mmap, ACCESS_READ
+
+from .metrics import metrics
+from .settings import CHECKPOINT_PATH, RAW_STORE_PATH, SEGMENT_SUFFIX, INDEX_SUFFIX
+
+
+def create_segment():
+    """Returns a path of a new raw store segment named after the time of the run, older segments are kept"""
+    makedirs(RAW_STORE_PATH, exist_ok=True)
+    return f"{RAW_STORE_PATH}/run_{strftime('%Y%m%dT%H%M%S', localtime())}{SEGMENT_SUFFIX}"
+
+
+def append_page(segment_path, results):
+    """
+        Appends a page to a segment as one gzip member (JSON line per launch) and adds its launches
+        to the segment index: [launch id, last_updated, member offset, member length, line in the member]
+    """
+    with metrics.timer('archive'):
+        member = compress(''.join(dumps(launch) + '\n' for launch in results).encode())
+        with open(segment_path, 'ab') as f:
+            offset = f.tell()
+            f.write(member)
+        with open(segment_path + INDEX_SUFFIX, 'a') as f:  # Written after the member, so the index points to data
+            for line, launch in enumerate(results):
+                f.write(dumps([launch['id'], launch['last_updated'], offset, len(member), line]) + '\n')
+    metrics.count('bytes_archived', value=len(member))
+
+
+def get_segments():
+    """Returns paths of raw store segments from the oldest to the newest"""
+    if not exists(RAW_STORE_PATH):
+        return []
+    return [f'{RAW_STORE_PATH}/{name}' for name in sorted(listdir(RAW_STORE_PATH)) if name.endswith(SEGMENT_SUFFIX)]
+
+
+def read_index(segment_path):
+    """Returns entries of a segment index"""
+    with open(segment_path + INDEX_SUFFIX) as f:
+        return [loads(line) for line in f]
+
+
+def get_segment_members(segment_path):
+    """Returns (offset, length) of gzip members (pages) of a segment in the order they were written"""
+    return sorted({(offset, length) for _, _, offset, length, _ in read_index(segment_path)})
+
+
+def read_segment(segment_path):
+    """Yields pages (lists of launches) of a segment, members are decompressed straight from the mapped file"""
+    with open(segment_path, 'rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as segment:
+        for offset, length in get_segment_members(segment_path):
+            lines = decompress(segment[offset:offset + length]).decode().splitlines()
+            yield [loads(line) for line in lines]
+
+
+def read_launch(launch_id):
+    """Returns the newest saved version of a launch, only its page is read from the segment"""
+    for segment_path in reversed(get_segments()):
+        entries = [entry for entry in read_index(segment_path) if entry[0] == launch_id]
+        if entries:
+            _, _, offset, length, line = max(entries, key=lambda entry: entry[1])  # The latest last_updated
+            with open(segment_path, 'rb') as f:
+                f.seek(offset)
+                lines = decompress(f.read(length)).decode().splitlines()
+            return loads(lines[line])
+    return None
+
+
+def read_checkpoint():
+    """Returns the checkpoint of an unfinished run: number of launches, offsets of loaded pages and its segment"""
+    if not exists(CHECKPOINT_PATH):
+        return None
+    with open(CHECKPOINT_PATH) as f:
+        return loads(f.read())
+
+
+def write_checkpoint(count, offsets_done, segment_path):
+    """Saves offsets of pages which are committed to the DB"""
+    with open(CHECKPOINT_PATH, 'w') as f:
+        f.write(dumps({'count': count, 'offsets_done': sorted(offsets_done), 'segment': segment_path}))
+
+
+def get_json_files(folder_path='./json_files'):
+    """Returns paths of the saved JSON files sorted by the first id of their range"""
+    file_names = [name for name in listdir(folder_path) if name.startswith('ids_') and name.endswith('.json')]
+    # 'ids_101-200.json' -> 101
+    file_names.sort(key=lambda name: int(name[4:-5].split('-')[0]))
+    return [f'{folder_path}/{name}' for name in file_names]
+
+
+def read_json_files(file_paths):
+    """Yields pages (lists of launches) of the saved JSON files"""
+    for file_path in file_paths:
+        print(file_path)
+        with open(file_path) as f:
+            yield loads(f.read())['results']
@@ -0,0 +1,245 @@
+"""Extraction of the tables from pages of launches, their dataframes and validation"""
+import pandas as pd
+import numpy as np
+from threading import Thread
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from queue import Queue
+from re import search, compile as re_compile
+
+from .metrics import metrics
+from .schema import TABLES, TABLE_FIELDS, TABLE_COLUMNS, TABLE_KEYS
+from .settings import TRANSFORM_WORKERS, TRANSFORM_QUEUE_SIZE
+
+UUID_PATTERN = re_compile(r'[0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}')
+
+
+def extract_tables(results):
+    """
+        Walks launches of a page once and fills column lists of every table using TABLE_FIELDS.
+        Empty strings are replaced with None so postgresql reads them as NULL
+    """
+    with metrics.timer('extract'), metrics.profile('extract'):
+        fields = [(table, column, path.split('.')) for table, columns in TABLE_FIELDS.items()
+                  for column, path in columns.items()]
+        tables = {table: {column: [] for column in columns} for table, columns in TABLE_FIELDS.items()}
+        for launch in results:
+            for table, column, keys in fields:
+                value = launch
+                for key in keys:
+                    value = value.get(key) if isinstance(value, dict) else None
+                tables[table][column].append(None if value == '' else value)
+    metrics.count('launches_extracted', value=len(results))
+    return tables
+
+
+def convert_column(values, sql_type):
+    """
+        Converts a column list to a typed nullable array: Int64 for INT, float64 for REAL, datetime64 in UTC
+        for TIMESTAMP and strings for the other types. Returns the array and a mask of values which couldn't be
+        converted (they become NULL)
+    """
+    present = np.array([value is not None for value in values], dtype=bool)
+    if sql_type in ['INT', 'REAL']:
+        try:
+            numbers = np.array(values, dtype=np.float64)  # None becomes NaN
+        except (TypeError, ValueError):
+            numbers = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce')
+            numbers = numbers.to_numpy(np.float64, na_value=np.nan)
+        if sql_type == 'REAL':
+            return numbers, present & np.isnan(numbers)
+        is_int = (numbers % 1 == 0) & (np.abs(numbers) < 2 ** 63)  # False for NaN
+        return pd.arrays.IntegerArray(np.where(is_int, numbers, 0).astype(np.int64), ~is_int), present & ~is_int
+    if sql_type == 'TIMESTAMP':
+        # The API sends times in UTC ('1957-10-04T19:28:34Z'), numpy parses them several times faster than pandas
+        if all(value is None or isinstance(value, str) and value.endswith('Z') for value in values):
+            try:
+                parsed = np.array([value and value[:-1] for value in values], dtype='datetime64[us]')
+                return pd.DatetimeIndex(parsed).tz_localize('UTC').array, np.zeros(len(values), dtype=bool)
+            except ValueError:  # Invalid dates are found by pandas
+                pass
+        timestamps = pd.to_datetime(pd.Series(values, dtype=object), errors='coerce', utc=True, format='ISO8601')
+        return timestamps.dt.as_unit('us').array, present & timestamps.isna().to_numpy()
+    return pd.array(values, dtype='string'), np.zeros(len(values), dtype=bool)
+
+
+def create_df(df_name, tables):
+    """
+        Creates a dataframe when we specify its name using column lists extracted from a JSON file.
+        Columns are typed by their SQL types, values which couldn't be converted are kept in attrs['unconverted']
+        (column -> {row: value}), so validate_df quarantines their rows
+    """
+    table_name = df_name.removesuffix('_df')
+    columns = TABLES[table_name]['columns']
+    with metrics.timer('create_df', table_name):
+        arrays, unconverted = {}, {}
+        for column, values in tables[table_name].items():
+            arrays[column], failed = convert_column(values, columns[column][0].split()[0].upper())
+            if failed.any():
+                unconverted[column] = {int(row): values[row] for row in np.flatnonzero(failed)}
+        df = pd.DataFrame(arrays)
+        if unconverted:  # pandas copies attrs to every dataframe and series derived from df
+            df.attrs['unconverted'] = unconverted
+    return df
+
+
+def hash_rows(df, columns):
+    """Returns a signed 64-bit hash of every row: each column is hashed at once by its type, hashes are combined"""
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    for column in columns:
+        series = df[column]
+        # Typed columns are hashed from their buffers, NULLs get a hash of their own. Strings are hashed as objects:
+        # NA of python and pyarrow storage hash differently, stored hashes mustn't depend on pyarrow being installed
+        if isinstance(series.dtype, np.dtype):
+            values = series.to_numpy()
+        elif isinstance(series.dtype, pd.StringDtype):
+            values = series.to_numpy(dtype=object, na_value=None)
+        else:
+            values = series.array
+        hashes = hashes * np.uint64(1000003) ^ pd.util.hash_array(values, categorize=False)
+    return hashes.astype(np.int64)
+
+
+def transform_df(df_name, df):
+    """
+        1. Drops rows with repeated keys;
+        2. Drops rows with None in 'required' columns of the table;
+        3. Adds 'last_updated_db' column to tables which have it (launch);
+        4. Adds 'row_hash' column, a 64-bit hash of the row content (hash_rows)
+    """
+    table_name = df_name.removesuffix('_df')
+    with metrics.timer('transform_df', table_name):
+        # Launches of a page share a few pads, locations and statuses, so each of them is sent once.
+        # Rows are dropped with a single mask, every selection copies all columns of the dataframe
+        keep = ~df[TABLE_KEYS[table_name]].duplicated().to_numpy()
+        for column in TABLES[table_name].get('required', []):
+            keep &= df[column].notna().to_numpy()
+        if not keep.all():
+            df = df[keep]
+
+        columns = {}
+        if 'last_updated_db' in TABLE_COLUMNS[table_name]:
+            columns['last_updated_db'] = pd.Timestamp('now').ceil(freq='s')
+        # last_updated_db is stamped by every run, so it isn't hashed
+        content = [column for column in TABLE_COLUMNS[table_name] if column not in ['last_updated_db', 'row_hash']]
+        columns['row_hash'] = hash_rows(df, content)
+        df = df.assign(**columns)
+    metrics.count('rows_transformed', table_name, len(df))
+    return df
+
+
+def validate_df(table_name, df, references=None):
+    """
+        Checks a transformed dataframe against columns of its table in TABLES, column by column for all rows at once:
+        1. NULL in NOT NULL and primary key columns;
+        2. Lengths of VARCHAR columns, the INT range, UUIDs and values create_df couldn't convert to the column types;
+        3. 'ranges' of the table;
+        4. Foreign keys, references: referenced table -> lists of keys the column may hold.
+        Returns valid rows and reasons of the invalid ones
+    """
+    spec = TABLES[table_name]
+    unconverted = df.attrs.get('unconverted', {})
+    problems = {}  # reason -> rows where it applies
+    for column, (definition, _) in spec['columns'].items():
+        if column not in df:  # serial columns
+            continue
+        series = df[column]
+        present = series.notna().to_numpy()
+        sql_type = definition.split()[0].upper()
+        # Values create_df couldn't convert to the column type, they are NULL in the dataframe
+        failed = df.index.isin(list(unconverted[column])) if column in unconverted else np.zeros(len(df), dtype=bool)
+        if 'NOT NULL' in definition or 'PRIMARY KEY' in definition:
+            problems[f'{column} is NULL'] = ~present & ~failed
+
+        # Checks run on numpy arrays, pandas operations cost more than the checks on pages of 100 rows
+        if sql_type.startswith('VARCHAR'):
+            limit = int(search(r'\((\d+)\)', sql_type).group(1))
+            values = series.to_numpy(dtype=object, na_value='').astype(str)
+            problems[f'{column} is longer than {limit}'] = np.char.str_len(values) > limit
+        elif sql_type == 'INT':
+            numbers = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            in_range = (numbers >= -2 ** 31) & (numbers < 2 ** 31)
+            problems[f'{column} is not an integer'] = failed | (present & ~in_range)
+        elif sql_type == 'REAL':
+            problems[f'{column} is not a number'] = failed
+        elif sql_type == 'UUID':
+            is_uuid = np.array([UUID_PATTERN.fullmatch(value) is not None
+                                for value in series.to_numpy(dtype=object, na_value='')], dtype=bool)
+            problems[f'{column} is not a UUID'] = present & ~is_uuid
+        elif sql_type == 'TIMESTAMP':
+            problems[f'{column} is not a timestamp'] = failed
+
+        if column in spec.get('ranges', {}):
+            low, high = spec['ranges'][column]
+            numbers = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            problems[f'{column} is out of range [{low}, {high}]'] = present & ~((numbers >= low) & (numbers <= high))
+
+        reference = spec.get('foreign_keys', {}).get(column)
+        if reference is not None and references is not None:
+            referenced_table = reference.split()[0]
+            known = np.zeros(len(df), dtype=bool)
+            for keys in references[referenced_table]:
+                known |= series.isin(keys).to_numpy(dtype=bool, na_value=False)
+            problems[f'{column} is not in {referenced_table}'] = present & ~known
+
+    invalid = np.logical_or.reduce(list(problems.values())) if problems else np.zeros(len(df), dtype=bool)
+    if not invalid.any():
+        return df, pd.Series(dtype=str)
+    checks = pd.DataFrame(problems, index=df.index)[invalid]
+    reasons = checks.apply(lambda row: '; '.join(row.index[row]), axis=1).astype(str)
+    return df[~invalid], reasons
+
+
+def transform_page(results):
+    """Extracts the tables of a page and returns their transformed dataframes"""
+    tables = extract_tables(results)
+    return {table: transform_df(f'{table}_df', create_df(f'{table}_df', tables)) for table in TABLE_COLUMNS}
+
+
+def transform_in_worker(results):
+    """Runs in a transform process: returns dataframes of a page with metrics of the process (Metrics.drain)"""
+    dataframes = transform_page(results)
+    return dataframes, metrics.drain()
+
+
+def transform_pages(pages, page_queue, workers):
+    """
+        Submits pages to a pool of 'workers' transform processes and puts their futures to page_queue in order,
+        None when finished. page_queue is bounded, so pages are read only as fast as the loader inserts them
+    """
+    try:
+        # Processes are spawned, a forked child could inherit locks held by the loader thread
+        with ProcessPoolExecutor(workers, mp_context=get_context('spawn')) as pool:
+            for results in pages:
+                page_queue.put(pool.submit(transform_in_worker, results))
+    except Exception as e:  # Reading a page failed, the loader raises it after loading the pages before it
+        page_queue.put(e)
+    page_queue.put(None)
+
+
+def transformed_pages(pages, workers=TRANSFORM_WORKERS):
+    """
+        Yields (transformed dataframes, None) of pages in order, (None, exception) for a page which failed to transform,
+        so the caller fails only that page. With workers > 0 pages are transformed by a process pool
+        while the caller loads the previous ones, so a load takes about max(transform, insert) instead of their sum
+    """
+    if not workers:
+        for results in pages:
+            try:
+                dataframes, error = transform_page(results), None
+            except Exception as e:
+                dataframes, error = None, e
+            yield dataframes, error
+        return
+    page_queue = Queue(maxsize=TRANSFORM_QUEUE_SIZE)
+    Thread(target=transform_pages, args=(pages, page_queue, workers), daemon=True).start()
+    for future in iter(page_queue.get, None):
+        if isinstance(future, Exception):  # The following pages can't be read, so the run fails
+            raise future
+        try:
+            dataframes, worker_metrics = future.result()
+        except Exception as e:
+            yield None, e
+            continue
+        metrics.merge(*worker_metrics)
+        yield dataframes, None